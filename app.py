@@ -4,27 +4,31 @@
 
 import streamlit as st
 import datetime
-import pandas as pd
+import sys
+import numpy as np
 import json
 import io
+import re
 import os
+import hashlib
+import hmac
+import collections
+import threading
+import importlib.util
 
 # ต้องติดตั้ง: pip install firebase-admin bcrypt streamlit-cookies-manager
 
+# โมดูลหนัก (pandas, bcrypt, firebase_admin, pyarrow) import เมื่อใช้งานจริงเท่านั้น
+# ที่นี่แค่เช็คว่าติดตั้งไว้หรือไม่
+
 # bcrypt (สำหรับ hashing password)
-try:
-    import bcrypt
-    bcrypt_installed = True
-except ImportError:
-    bcrypt_installed = False
+bcrypt_installed = importlib.util.find_spec("bcrypt") is not None
+if not bcrypt_installed:
     st.warning("⚠️ Missing bcrypt — running in Mock Mode", icon="🚨")
 
 # Firebase Admin SDK
-try:
-    from firebase_admin import credentials, firestore, initialize_app, get_app
-    firebase_installed = True
-except ImportError:
-    firebase_installed = False
+firebase_installed = importlib.util.find_spec("firebase_admin") is not None
+if not firebase_installed:
     st.error("❌ Missing firebase-admin library", icon="🚨")
 
 # 🔐 Cookie Manager
@@ -64,11 +68,62 @@ ROOMS = {
     "ISE_Meeting_Room_III_304/1_Fl1": {"capacity": 20, "has_projector": True}
 }
 
+# ชื่อห้อง intern ไว้ + รหัส int ต่อห้อง (ใช้เทียบแทน string)
+ROOM_NAMES = tuple(sys.intern(k) for k in ROOMS)
+ROOM_CODE = {name: i for i, name in enumerate(ROOM_NAMES)}
+
+# ช่องเวลาละ 30 นาที 08:00 - 16:30 (นาทีนับจากเที่ยงคืน)
+SLOT_STARTS_MIN = np.arange(8 * 60, 17 * 60, 30, dtype=np.int32)
+TIME_LABELS = [f"{m // 60:02d}:{m % 60:02d}" for m in SLOT_STARTS_MIN]
+
+# ตารางว่างต้นแบบ (copy ทุกครั้งที่สร้างตารางของวันใหม่)
+EMPTY_AVAILABILITY = np.full((len(SLOT_STARTS_MIN), len(ROOM_NAMES)), "✅ Available", dtype=object)
+
+AVAILABLE_CSS = "background-color:#d4edda;color:#155724"
+BOOKED_CSS = "background-color:#f8d7da;color:#721c24"
+EMPTY_AVAILABILITY_CSS = np.full(EMPTY_AVAILABILITY.shape, AVAILABLE_CSS, dtype=object)
+
+BOOKINGS_PAGE_SIZE = 50
+
+# คอลัมน์ของตาราง All Bookings
+BOOKING_TABLE_COLUMNS = ["room", "date", "start_time", "end_time", "user_id"]
+
+# field ที่เก็บลง Firestore ต่อ booking
+BOOKING_FIELDS = (
+    "room", "date", "start_time", "end_time",
+    "start_min", "end_min", "user_id", "user_email"
+)
+
+# คอลัมน์ที่ export เป็น CSV -> ชื่อหัวตาราง
+EXPORT_COLUMNS = {
+    "room": "Room",
+    "date": "Date",
+    "start_time": "StartTime",
+    "end_time": "EndTime",
+    "user_id": "Username",
+    "user_email": "Email"
+}
+
 
 ###############################################
 #         FIREBASE INITIAL CONNECTION         #
 ###############################################
 
+@st.cache_resource
+def get_db():
+    from firebase_admin import credentials, firestore, initialize_app, get_app
+
+    # client เดียวต่อ process: ใช้ gRPC channel / token ร่วมกันทุก session
+    try:
+        get_app()
+    except ValueError:
+        key_dict = json.loads(st.secrets["firestore_credentials"])
+        cred = credentials.Certificate(key_dict)
+        initialize_app(cred)
+
+    return firestore.client()
+
+
 def init_database_connection():
     if 'db_ready' in st.session_state:
         return
@@ -78,55 +133,124 @@ def init_database_connection():
         return
 
     try:
-        try:
-            get_app()
-        except Exception:
-            key_dict = json.loads(st.secrets["firestore_credentials"])
-            cred = credentials.Certificate(key_dict)
-            initialize_app(cred)
-
-        st.session_state.db = firestore.client()
+        get_db()
         st.session_state.db_ready = True
         st.sidebar.success("🌐 Firestore Connected")
+        watch_bookings()
 
     except Exception as e:
         st.session_state.db_ready = False
         st.sidebar.error(f"❌ Firestore Error: {e}")
 
 
+###############################################
+#              PASSWORD HASHING               #
+###############################################
+
+# cost factor ปรับได้ผ่าน st.secrets["BCRYPT_ROUNDS"]
+try:
+    BCRYPT_ROUNDS = int(st.secrets["BCRYPT_ROUNDS"])
+except Exception:
+    BCRYPT_ROUNDS = 12
+
+
+# รูปแบบ hash ของ bcrypt: $2b$<cost>$<salt+hash 53 ตัว>
+BCRYPT_HASH_RE = re.compile(r"\$2[aby]\$\d{2}\$[./A-Za-z0-9]{53}")
+
+
+def hash_password(pw):
+    import bcrypt
+
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    return bcrypt.hashpw(pw.encode(), salt).decode()
+
+
+@st.cache_resource
+def get_dummy_hash():
+    if not bcrypt_installed:
+        return mock_hash_password(os.urandom(16).hex())
+    return hash_password(os.urandom(16).hex())
+
+
+def verify_password(pw, stored):
+    # ไม่ cache ผล: login ตรวจเฉพาะตอนกด submit และทุกครั้งต้องเสียเวลาเท่ากัน
+    # (cache ผลของ dummy hash จะทำให้เดา username ที่มีอยู่จริงจากเวลาตอบได้)
+    import bcrypt
+
+    return bcrypt.checkpw(pw.encode(), stored.encode())
+
+
+# Mock Mode (ไม่มี bcrypt): ใช้ scrypt ของ hashlib (OpenSSL) + salt ต่อ user
+MOCK_HASH_PREFIX = "scrypt$"
+SCRYPT_PARAMS = {"n": 2 ** 14, "r": 8, "p": 1, "dklen": 32}
+
+
+def mock_hash_password(pw):
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(pw.encode(), salt=salt, **SCRYPT_PARAMS)
+    return f"{MOCK_HASH_PREFIX}{salt.hex()}${digest.hex()}"
+
+
+def mock_verify_password(pw, stored):
+    try:
+        salt_hex, digest_hex = stored[len(MOCK_HASH_PREFIX):].split("$")
+        salt, expected = bytes.fromhex(salt_hex), bytes.fromhex(digest_hex)
+    except ValueError:
+        return False
+    digest = hashlib.scrypt(pw.encode(), salt=salt, **SCRYPT_PARAMS)
+    return hmac.compare_digest(digest, expected)
+
+
+def check_password(pw, stored):
+    if bcrypt_installed and BCRYPT_HASH_RE.fullmatch(stored):
+        return verify_password(pw, stored)
+    if stored.startswith(MOCK_HASH_PREFIX):
+        return mock_verify_password(pw, stored)
+
+    # hash ใช้ไม่ได้ (บัญชี MOCK_HASH_FOR_ รุ่นเก่า, hash ปลอมของ fallback user, hash เสีย):
+    # ปฏิเสธเสมอ แต่ยังตรวจกับ dummy hash ให้ใช้เวลาเท่ากับ user จริง/ไม่มีจริง
+    check_password(pw, get_dummy_hash())
+    return False
+
+
 ###############################################
 #          SESSION INITIALIZATION             #
 ###############################################
 
 def initialize_state():
-    init_database_connection()
+    # ทำครั้งเดียวต่อ session ก่อน widget ใดจะอ่าน state
+    if "initialized" in st.session_state:
+        return
 
-    if "rooms" not in st.session_state:
-        st.session_state.rooms = ROOMS
+    init_database_connection()
 
     # ⭐ Auto-login using cookies
-    if "authenticated_user" not in st.session_state:
-        saved_user = cookies.get("auth_user")
-        saved_role = cookies.get("auth_role")
-        st.session_state.authenticated_user = saved_user if saved_user else None
-        st.session_state.user_role = saved_role if saved_role else None
+    defaults = {
+        "authenticated_user": cookies.get("auth_user") or None,
+        "user_role": cookies.get("auth_role") or None,
+        "user_email": None,
+        "mode": "login"
+    }
+    for key, value in defaults.items():
+        st.session_state.setdefault(key, value)
 
-    if "mode" not in st.session_state:
-        st.session_state.mode = "login"
+    st.session_state.initialized = True
 
 
 ###############################################
 #                DATABASE OPS                 #
 ###############################################
 
-@st.cache_data(ttl=3600)
+# cache_resource: ทุก session ใช้ dict เดียวกัน ไม่ต้อง pickle/copy ทุกครั้งที่เรียก
+# (ห้ามแก้ dict ที่ได้ไป ถ้าเพิ่ม user ให้ .clear() แล้วโหลดใหม่)
+@st.cache_resource(ttl=3600)
 def load_users_from_db():
     if not st.session_state.db_ready:
         return MOCK_USER_FALLBACK
 
     try:
         users = {}
-        docs = st.session_state.db.collection("users").stream()
+        docs = get_db().collection("users").stream()
         for doc in docs:
             users[doc.id] = doc.to_dict()
         return users if users else MOCK_USER_FALLBACK
@@ -135,13 +259,50 @@ def load_users_from_db():
         return MOCK_USER_FALLBACK
 
 
-@st.cache_data(ttl=5)
-def load_bookings_from_db():
+@st.cache_resource
+def _bookings_versions():
+    # ตัวนับ version ร่วมทั้ง process ใช้เป็นส่วนหนึ่งของ cache key แทนการ .clear()
+    # "*" = ทุก key, date_iso = วันนั้น, "pages" = ตาราง All Bookings
+    # หลาย session เขียนพร้อมกันได้ จึงต้องมี lock
+    return collections.Counter(), threading.Lock()
+
+
+def bookings_version(key):
+    versions, _ = _bookings_versions()
+    return versions["*"], versions[key]
+
+
+def bump_bookings_version(*keys):
+    versions, lock = _bookings_versions()
+    with lock:
+        for key in keys or ("*",):
+            versions[key] += 1
+
+
+def normalize_bookings(docs):
+    # ทำให้ทุก booking มี start_min/end_min ครั้งเดียวตอนโหลด
+    # ข้างล่าง (ตาราง/conflict) จะไม่ต้อง parse เวลาอีก; แถวที่เสียถูกข้าม
+    bookings = []
+    for doc in docs:
+        d = doc.to_dict()
+        d["doc_id"] = doc.id
+        if "start_min" not in d:
+            try:
+                d["start_min"], d["end_min"] = booking_minutes(d)
+            except Exception:
+                continue
+        bookings.append(d)
+    return bookings
+
+
+# export ทั้งหมดเปลี่ยนไม่บ่อย -> TTL ยาว (admin กด Refresh = bump version "export")
+@st.cache_data(ttl=300)
+def load_all_bookings(version):
     if not st.session_state.db_ready:
         return []
 
     try:
-        docs = st.session_state.db.collection("bookings").stream()
+        docs = get_db().collection("bookings").stream()
         bookings = []
         for doc in docs:
             d = doc.to_dict()
@@ -152,12 +313,101 @@ def load_bookings_from_db():
         return []
 
 
+# version มาจาก bookings_version(date_iso) ใช้แค่เป็น cache key
+# TTL มีไว้สำหรับการเขียนจาก process อื่นเท่านั้น
+@st.cache_data(ttl=60)
+def load_bookings_for_date(date_iso, version):
+    if not st.session_state.db_ready:
+        return []
+
+    from firebase_admin import firestore
+
+    try:
+        query = get_db().collection("bookings").where(
+            filter=firestore.FieldFilter("date", "==", date_iso)
+        )
+
+        return normalize_bookings(query.stream())
+    except Exception:
+        return []
+
+
+def load_bookings_candidate(room, date_iso, ns_min, ne_min, transaction=None):
+    from firebase_admin import firestore
+
+    # range ได้แค่ field เดียว -> ให้ Firestore กรอง start_min < ne แล้วกรอง end_min ต่อเอง
+    # ต้องมี composite index (room, date, start_min) ดู firestore.indexes.json
+    query = (
+        get_db().collection("bookings")
+        .where(filter=firestore.FieldFilter("room", "==", room))
+        .where(filter=firestore.FieldFilter("date", "==", date_iso))
+        .where(filter=firestore.FieldFilter("start_min", "<", ne_min))
+    )
+
+    # booking เก่าที่ไม่มี start_min จะไม่ติด query นี้ -> รัน backfill_booking_minutes.py ก่อน deploy
+    return [b for b in normalize_bookings(query.stream(transaction=transaction))
+            if b["end_min"] > ns_min]
+
+
+@st.cache_resource
+def watch_bookings():
+    # listener เดียวต่อ process: booking ที่เปลี่ยนจากที่อื่น (process อื่น / console)
+    # จะ bump version ของวันนั้นทันที แทนที่จะรอ TTL หมด
+    # callback รันใน thread ของ Firestore -> จับ counter/lock ไว้ตั้งแต่ตอนนี้
+    from firebase_admin import firestore
+
+    versions, lock = _bookings_versions()
+    initial = [True]
+
+    def on_change(docs, changes, read_time):
+        # snapshot แรกคือทั้ง collection (ADDED ทุกตัว) ไม่ใช่การเปลี่ยนแปลง
+        if initial[0]:
+            initial[0] = False
+            return
+
+        dates = {(c.document.to_dict() or {}).get("date") for c in changes}
+        with lock:
+            for key in dates - {None}:
+                versions[key] += 1
+            versions["pages"] += 1
+            versions["export"] += 1
+
+    # ดูเฉพาะตั้งแต่เมื่อวาน: snapshot แรกไม่ต้องอ่านประวัติทั้งหมด
+    # (booking เก่าแทบไม่เปลี่ยน ถ้าเปลี่ยนก็รอ TTL)
+    since = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+    query = get_db().collection("bookings").where(filter=firestore.FieldFilter("date", ">=", since))
+    return query.on_snapshot(on_change)
+
+
+@st.cache_data(ttl=60)
+def load_bookings_page(cursor, version):
+    if not st.session_state.db_ready:
+        return []
+
+    try:
+        col = get_db().collection("bookings")
+        # เรียง (date, start_min) ที่ฝั่ง Firestore ด้วย composite index -> ฝั่งแอปไม่ต้อง sort ซ้ำ
+        # document ที่ไม่มี start_min จะไม่ถูกส่งมา (ดู backfill_booking_minutes.py)
+        query = col.order_by("date").order_by("start_min").limit(BOOKINGS_PAGE_SIZE)
+        if cursor:
+            query = query.start_after(col.document(cursor).get())
+
+        bookings = []
+        for doc in query.stream():
+            d = doc.to_dict()
+            d["doc_id"] = doc.id
+            bookings.append(d)
+        return bookings
+    except Exception:
+        return []
+
+
 def save_new_user_to_db(username, email, hashed_password):
     if not st.session_state.db_ready:
         return False
 
     try:
-        st.session_state.db.collection("users").document(username).set({
+        get_db().collection("users").document(username).set({
             "email": email,
             "hashed_password": hashed_password,
             "role": "user"
@@ -168,26 +418,64 @@ def save_new_user_to_db(username, email, hashed_password):
         return False
 
 
+class BookingConflict(Exception):
+    pass
+
+
+def booking_doc_id(booking):
+    # ห้องเดียวกัน วันเดียวกัน เริ่มเวลาเดียวกัน ชนกันแน่นอน -> id ซ้ำ = create() ล้มทันที
+    # document id ห้ามมี "/" (ชื่อห้อง III มี "304/1")
+    doc_id = f"{booking['room']}__{booking['date']}__{booking['start_time']}"
+    return doc_id.replace("/", "-")
+
+
 def save_booking_to_db(new_booking):
     if not st.session_state.db_ready:
         return False
 
+    from firebase_admin import firestore
+    from google.api_core.exceptions import AlreadyExists
+
+    db = get_db()
+    payload = {k: new_booking[k] for k in BOOKING_FIELDS}
+    doc_ref = db.collection("bookings").document(booking_doc_id(new_booking))
+
+    # อ่านเฉพาะ booking ที่อาจชน แล้วเขียนใน transaction เดียว (กัน double booking)
+    def book(transaction):
+        existing = load_bookings_candidate(
+            new_booking["room"], new_booking["date"],
+            new_booking["start_min"], new_booking["end_min"],
+            transaction=transaction
+        )
+        if is_conflict(existing):
+            raise BookingConflict()
+        transaction.create(doc_ref, payload)
+        # audit เขียนใน commit เดียวกับ booking (ไม่เพิ่ม round trip)
+        transaction.set(db.collection("audit_log").document(), {
+            "action": "create_booking",
+            "booking_id": doc_ref.id,
+            "user_id": new_booking["user_id"],
+            "at": firestore.SERVER_TIMESTAMP
+        })
+
     try:
-        payload = {k: v for k, v in new_booking.items() if not k.endswith("_obj")}
-        st.session_state.db.collection("bookings").add(payload)
-        load_bookings_from_db.clear()
-        return True
+        firestore.transactional(book)(db.transaction())
+    except (BookingConflict, AlreadyExists):
+        raise BookingConflict()
     except:
         return False
 
+    bump_bookings_version(new_booking["date"], "pages")
+    return True
+
 
 def delete_booking_from_db(doc_id):
     if not st.session_state.db_ready:
         return False
 
     try:
-        st.session_state.db.collection("bookings").document(doc_id).delete()
-        load_bookings_from_db.clear()
+        get_db().collection("bookings").document(doc_id).delete()
+        bump_bookings_version()
         return True
     except:
         return False
@@ -197,34 +485,43 @@ def delete_booking_from_db(doc_id):
 #             BUSINESS LOGIC                  #
 ###############################################
 
-def is_conflict(new, existing):
-    room = new["room"]
-    date = new["date_obj"]
+def _hhmm_to_min(s):
+    return int(s[:2]) * 60 + int(s[3:5])
 
-    ns = new["start_time_obj"]
-    ne = new["end_time_obj"]
 
-    ns_sec = ns.hour * 3600 + ns.minute * 60
-    ne_sec = ne.hour * 3600 + ne.minute * 60
+def booking_minutes(b):
+    # booking ใหม่เก็บ start_min/end_min ไว้แล้ว, ของเก่า parse จาก "HH:MM"
+    if "start_min" in b:
+        return b["start_min"], b["end_min"]
+    return _hhmm_to_min(b["start_time"]), _hhmm_to_min(b["end_time"])
 
-    for b in existing:
-        try:
-            bd = datetime.date.fromisoformat(b["date"])
-            if bd != date or b["room"] != room:
-                continue
 
-            s = datetime.time.fromisoformat(b["start_time"])
-            e = datetime.time.fromisoformat(b["end_time"])
+def is_conflict(existing):
+    # load_bookings_candidate คืนเฉพาะ booking ที่ทับช่วงเวลาใหม่จริง (ห้อง/วันเดียวกัน,
+    # start_min < ne และ end_min > ns) -> มีอย่างน้อยหนึ่งรายการ = ชน
+    return bool(existing)
 
-            s_sec = s.hour * 3600 + s.minute * 60
-            e_sec = e.hour * 3600 + e.minute * 60
 
-            if not (ne_sec <= s_sec or ns_sec >= e_sec):
-                return True
-        except:
-            continue
+@st.cache_data(ttl=300, show_spinner=False)
+def export_bookings_csv(version):
+    # เก็บ bytes ไว้ทั้งก้อน: rerun หน้าเดิมไม่ต้อง serialize CSV ใหม่
+    rows = load_all_bookings(version)
+    # สร้างทีละคอลัมน์ด้วยชื่อหัวตารางเลย (ไม่ copy / rename)
+    columns = {
+        label: [b.get(field) for b in rows] for field, label in EXPORT_COLUMNS.items()
+    }
+    return bookings_to_csv(columns)
 
-    return False
+
+def bookings_to_csv(columns):
+    # pyarrow มากับ streamlit เสมอ (dependency ของ streamlit เอง)
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+
+    # สร้าง Arrow table จากคอลัมน์ตรง ๆ ไม่ผ่าน pandas แล้วเขียนลง buffer ของ Arrow
+    sink = pa.BufferOutputStream()
+    pacsv.write_csv(pa.table(columns), sink)
+    return sink.getvalue().to_pybytes()
 
 
 def handle_signup(username, email, pw, pw2):
@@ -239,9 +536,10 @@ def handle_signup(username, email, pw, pw2):
         return
 
     if bcrypt_installed:
-        hashed = bcrypt.hashpw(pw.encode(), bcrypt.gensalt()).decode()
+        with st.spinner("Creating account…"):
+            hashed = hash_password(pw)
     else:
-        hashed = "MOCK_HASH_FOR_" + username
+        hashed = mock_hash_password(pw)
 
     if save_new_user_to_db(username, email, hashed):
         st.toast("🎉 Sign up success!")
@@ -251,9 +549,18 @@ def handle_signup(username, email, pw, pw2):
         st.toast("❌ Could not save user")
 
 
+def current_user_email():
+    # auto-login จาก cookie ไม่มี email -> อ่านจาก users ครั้งเดียวแล้วเก็บไว้ใน session
+    if st.session_state.user_email is None:
+        info = load_users_from_db().get(st.session_state.authenticated_user, {})
+        st.session_state.user_email = info.get("email")
+    return st.session_state.user_email
+
+
 def handle_logout():
     st.session_state.authenticated_user = None
     st.session_state.user_role = None
+    st.session_state.user_email = None
 
     cookies["auth_user"] = ""
     cookies["auth_role"] = ""
@@ -269,13 +576,11 @@ def handle_logout():
 
 def display_profile_card():
     user = st.session_state.authenticated_user
-    users = load_users_from_db()
-    info = users.get(user, {})
 
     st.sidebar.markdown("---")
     st.sidebar.write(f"👤 **{user}**")
-    st.sidebar.write(f"📧 {info.get('email')}")
-    st.sidebar.write(f"🏷️ Role: {info.get('role')}")
+    st.sidebar.write(f"📧 {current_user_email()}")
+    st.sidebar.write(f"🏷️ Role: {st.session_state.user_role}")
 
     st.sidebar.button("Logout", on_click=handle_logout)
 
@@ -291,29 +596,26 @@ def display_login_form():
         ok = st.form_submit_button("Login")
 
     if ok:
-        if u not in users:
-            st.toast("❌ User not found")
-            return
-
-        stored = users[u]["hashed_password"]
+        # user ไม่มีจริงก็ยังรัน bcrypt กับ dummy hash -> เวลาตอบสนองเท่ากัน
+        # และแจ้ง error เดียวกัน (ไม่บอกว่ามี username นี้หรือไม่)
+        user = users.get(u)
+        stored = user["hashed_password"] if user else get_dummy_hash()
 
-        correct = False
-        if bcrypt_installed and stored.startswith("$2b$"):
-            correct = bcrypt.checkpw(p.encode(), stored.encode())
-        else:
-            correct = (stored == "MOCK_HASH_FOR_" + u)
+        with st.spinner("Authenticating…"):
+            correct = check_password(p, stored)
 
-        if correct:
+        if correct and user is not None:
             st.session_state.authenticated_user = u
-            st.session_state.user_role = users[u]["role"]
+            st.session_state.user_role = user["role"]
+            st.session_state.user_email = user["email"]
 
             cookies["auth_user"] = u
-            cookies["auth_role"] = users[u]["role"]
+            cookies["auth_role"] = user["role"]
             cookies.save()
 
             st.rerun()
         else:
-            st.toast("❌ Wrong password")
+            st.toast("❌ Wrong username or password")
 
     if st.sidebar.button("Sign Up"):
         st.session_state.mode = "signup"
@@ -342,14 +644,21 @@ def display_signup_form():
 #      DISPLAY BOOKING + AVAILABILITY UI      #
 ###############################################
 
+# แต่ละส่วนของหน้าหลักเป็น fragment: กด widget ในส่วนไหนก็ rerun แค่ส่วนนั้น
+@st.fragment
 def display_booking_form():
     st.subheader("📝 New Booking")
 
+    # ข้อความจากการจองรอบก่อน (ต้อง rerun ทั้งหน้าเพื่อให้ตารางเห็น booking ใหม่)
+    notice = st.session_state.pop("booking_notice", None)
+    if notice:
+        st.toast(notice)
+
     user = st.session_state.authenticated_user
-    email = load_users_from_db()[user]["email"]
+    email = current_user_email()
 
     with st.form("booking_form", clear_on_submit=True):
-        room = st.selectbox("Room", list(ROOMS.keys()))
+        room = st.selectbox("Room", ROOM_NAMES)
         date = st.date_input("Date", datetime.date.today())
         start = st.time_input("Start", datetime.time(9, 0))
         end = st.time_input("End", datetime.time(10, 0))
@@ -361,76 +670,115 @@ def display_booking_form():
             st.toast("❌ Start must be before end")
             return
 
-        existing = load_bookings_from_db()
-
         new = {
             "room": room,
             "date": date.isoformat(),
             "start_time": start.isoformat(timespec="minutes"),
             "end_time": end.isoformat(timespec="minutes"),
+            "start_min": start.hour * 60 + start.minute,
+            "end_min": end.hour * 60 + end.minute,
             "user_id": user,
-            "user_email": email,
-            "date_obj": date,
-            "start_time_obj": start,
-            "end_time_obj": end
+            "user_email": email
         }
 
-        if is_conflict(new, existing):
+        try:
+            saved = save_booking_to_db(new)
+        except BookingConflict:
             st.toast("❌ Time conflict!")
             return
 
-        if save_booking_to_db(new):
-            st.toast("✅ Booking successful!")
+        if saved:
+            st.session_state.booking_notice = "✅ Booking successful!"
+            st.rerun()
 
 
-def display_availability_matrix():
-    st.subheader("📅 Room Availability Today")
+@st.cache_data(ttl=60)
+def bookings_page_table(cursor, version):
+    # key เดียวกับ load_bookings_page -> rerun ที่ไม่เกี่ยวข้องไม่ต้องสร้าง DataFrame ใหม่
+    # หน้าที่ได้มาเรียงตาม (date, start_min) แล้ว
+    import pandas as pd
+
+    return pd.DataFrame(load_bookings_page(cursor, version), columns=BOOKING_TABLE_COLUMNS)
 
-    view_date = st.date_input("Select Date", datetime.date.today())
-    bookings = load_bookings_from_db()
 
-    time_slots = []
-    for h in range(8, 17):
-        time_slots.append(f"{h:02d}:00")
-        time_slots.append(f"{h:02d}:30")
+@st.cache_data(ttl=60)
+def build_availability(intervals):
+    import pandas as pd
 
-    df = pd.DataFrame("🟢", index=time_slots, columns=list(ROOMS.keys()))
+    if not intervals:
+        empty_df = pd.DataFrame(EMPTY_AVAILABILITY.copy(), index=TIME_LABELS, columns=ROOM_NAMES)
+        return empty_df, EMPTY_AVAILABILITY_CSS
 
-    for b in bookings:
-        if b["date"] != view_date.isoformat():
-            continue
+    rooms = np.array([ROOM_CODE.get(r, -1) for r, _, _, _ in intervals], dtype=np.int8)
+    starts = np.array([s for _, s, _, _ in intervals], dtype=np.int16)
+    ends = np.array([e for _, _, e, _ in intervals], dtype=np.int16)
+    labels = np.array([f"❌ Booked by {u}" for _, _, _, u in intervals], dtype=object)
 
-        room = b["room"]
-        s = datetime.time.fromisoformat(b["start_time"])
-        e = datetime.time.fromisoformat(b["end_time"])
+    # overlap[slot, room, booking] คำนวณทีเดียวทั้งตาราง ไม่วนทีละห้อง
+    slot_starts = SLOT_STARTS_MIN[:, None]
+    in_slot = (slot_starts < ends) & (slot_starts + 30 > starts)
+    in_room = rooms == np.arange(len(ROOM_NAMES), dtype=np.int8)[:, None]
+    overlap = in_slot[:, None, :] & in_room[None, :, :]
 
-        for t in time_slots:
-            slot = datetime.datetime.strptime(t, "%H:%M").time()
-            slot_end = (datetime.datetime.combine(view_date, slot) +
-                        datetime.timedelta(minutes=30)).time()
+    booked = overlap.any(axis=2)
+    # booking แรกที่ทับ slot นั้น (argmax ของ bool = True ตัวแรก)
+    cells = np.where(booked, labels[overlap.argmax(axis=2)], EMPTY_AVAILABILITY)
 
-            if not (slot_end <= s or slot >= e):
-                df.loc[t, room] = "🔴"
+    # css ของทุก cell คำนวณครั้งเดียวแล้ว cache ไปพร้อมตาราง
+    css = np.where(booked, BOOKED_CSS, AVAILABLE_CSS)
+    return pd.DataFrame(cells, index=TIME_LABELS, columns=ROOM_NAMES), css
 
-    st.dataframe(df)
 
+@st.fragment
+def display_availability_matrix():
+    st.subheader("📅 Room Availability Today")
 
+    view_date = st.date_input("Select Date", datetime.date.today())
+    view_iso = view_date.isoformat()
+    daily = load_bookings_for_date(view_iso, bookings_version(view_iso))
+
+    # key ของ cache = ช่วงเวลาที่จองของวันนั้น (วันที่ต่างกันแต่ตารางเหมือนกันใช้ร่วมกันได้)
+    intervals = tuple(sorted(
+        (b["room"], b["start_min"], b["end_min"], b.get("user_id", "")) for b in daily
+    ))
+    availability_df, css = build_availability(intervals)
+
+    # สีทั้งตารางในครั้งเดียว (ไม่เรียก callback ต่อ cell)
+    st.dataframe(availability_df.style.apply(lambda _: css, axis=None))
+
+
+@st.fragment
 def display_data_and_export():
     st.subheader("📋 All Bookings")
 
-    bookings = load_bookings_from_db()
-    if not bookings:
+    pages = st.session_state.setdefault("bookings_pages", [None])
+    version = bookings_version("pages")
+    bookings = load_bookings_page(pages[-1], version)
+    if not bookings and len(pages) == 1:
         st.info("No bookings yet")
         return
 
-    df = pd.DataFrame(bookings)
-    df_show = df[["room", "date", "start_time", "end_time", "user_id"]]
-    st.dataframe(df_show, hide_index=True)
+    st.dataframe(bookings_page_table(pages[-1], version), hide_index=True)
+
+    if st.button("⬅️ Previous", disabled=len(pages) == 1):
+        pages.pop()
+        st.rerun(scope="fragment")
+    if st.button("Next ➡️", disabled=len(bookings) < BOOKINGS_PAGE_SIZE):
+        pages.append(bookings[-1]["doc_id"])
+        st.rerun(scope="fragment")
 
     # Export (admin only)
     if st.session_state.user_role == "admin":
-        csv = df.to_csv(index=False).encode()
-        st.download_button("Download CSV", csv, "bookings.csv")
+        # อ่านทั้ง collection เฉพาะตอน admin ขอ export จริง ๆ
+        if st.button("📦 Prepare CSV"):
+            st.session_state.export_requested = True
+
+        if st.session_state.get("export_requested"):
+            if st.button("🔄 Refresh export"):
+                bump_bookings_version("export")
+
+            csv = export_bookings_csv(bookings_version("export"))
+            st.download_button("Download CSV", csv, "bookings.csv")
 
 
 ###############################################
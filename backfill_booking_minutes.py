@@ -0,0 +1,54 @@
+###############################################
+#   BACKFILL start_min / end_min (ONE-OFF)    #
+###############################################
+
+# booking เก่าที่ไม่มี start_min/end_min จะไม่ติด range query ตอนตรวจเวลาชน
+# และไม่ขึ้นในตาราง All Bookings (order_by start_min) -> รันสคริปต์นี้ครั้งเดียวก่อน deploy
+#
+#   python backfill_booking_minutes.py path/to/service-account.json
+
+import sys
+
+from firebase_admin import credentials, firestore, initialize_app
+
+
+def hhmm_to_min(s):
+    return int(s[:2]) * 60 + int(s[3:5])
+
+
+def backfill(db):
+    # BulkWriter รวม write เป็น batch ส่งขนานกันเอง พร้อม retry/throttle ให้
+    bulk = db.bulk_writer()
+    updated = 0
+    skipped = []
+
+    for doc in db.collection("bookings").stream():
+        d = doc.to_dict()
+        if "start_min" in d:
+            continue
+        try:
+            start_min, end_min = hhmm_to_min(d["start_time"]), hhmm_to_min(d["end_time"])
+        except Exception:
+            # parse เวลาไม่ได้ -> ไม่มี start_min จะหายจากตาราง All Bookings ต้องแก้เอง
+            skipped.append((doc.id, d.get("start_time"), d.get("end_time")))
+            continue
+
+        bulk.update(doc.reference, {"start_min": start_min, "end_min": end_min})
+        updated += 1
+
+    bulk.close()
+    return updated, skipped
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit(f"usage: python {sys.argv[0]} <service-account.json>")
+
+    initialize_app(credentials.Certificate(sys.argv[1]))
+    updated, skipped = backfill(firestore.client())
+
+    print(f"updated {updated} bookings")
+    for doc_id, start_time, end_time in skipped:
+        print(f"skipped {doc_id}: start_time={start_time!r} end_time={end_time!r}")
+    if skipped:
+        sys.exit(f"{len(skipped)} bookings need start_time/end_time fixed by hand")